@@ -4,8 +4,6 @@ import json
 import logging
 import sys
 
-import yaml
-
 from chtools.cli.handler import CliHandler
 from chtools.cli.file import read_spec_file, read_schema_file
 from chtools.aws_account.client import AwsAccountClient
@@ -90,6 +88,9 @@ class AwsAccountCliHandler(CliHandler):
         return results
 
     def _get_spec(self):
+        # Imported here so other actions don't need to load yaml
+        import yaml
+
         aws_account = json.loads(self._get_schema())
         results = yaml.dump(aws_account.schema, default_flow_style=False)
         return results
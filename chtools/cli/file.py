@@ -1,5 +1,5 @@
 import json
-import yaml
+import os
 
 
 def read_schema_file(file_path):
@@ -9,6 +9,41 @@ def read_schema_file(file_path):
 
 
 def read_spec_file(file_path):
+    # Imported here so actions that don't use specs don't need to load yaml
+    import yaml
+
+    # Use the libyaml based loader when PyYAML has been built with it
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
     with open(file_path) as spec_file:
-        spec = yaml.load(spec_file)
+        spec = yaml.load(spec_file, Loader=loader)
     return spec
+
+
+def read_spec_files(path):
+    """Returns a list of specs from a spec file or directory of spec files.
+
+    A spec file may contain a single spec or a list of specs. All files ending
+    in .yaml or .yml are read from a directory.
+    """
+    if os.path.isdir(path):
+        file_paths = [
+            os.path.join(path, file_name) for file_name
+            in sorted(os.listdir(path))
+            if file_name.endswith(('.yaml', '.yml'))
+        ]
+    else:
+        file_paths = [path]
+
+    specs = []
+    for file_path in file_paths:
+        spec = read_spec_file(file_path)
+        if type(spec) is list:
+            specs.extend(spec)
+        else:
+            specs.append(spec)
+
+    if not specs:
+        raise RuntimeError(
+            "No specs found in {}".format(path)
+        )
+    return specs
@@ -2,10 +2,29 @@ import json
 import logging
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# orjson is optional, but encodes large schemas much faster than json
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
 DEFAULT_CLOUDHEALTH_API_URL = 'https://chapi.cloudhealthtech.com/'
+# Connections kept open to the CloudHealth API so that sequential calls
+# don't each need a new TCP and TLS handshake.
+DEFAULT_POOL_SIZE = 10
+
+
+class HTTPError(RuntimeError):
+    """Raised when CloudHealth responds with a non 2xx status code"""
+    def __init__(self, message, status_code, response_message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response_message = response_message
 
 
 class HTTPClient:
@@ -14,6 +33,23 @@ class HTTPClient:
         self._headers = {'Content-type': 'application/json'}
         self._params = {'api_key': api_key,
                         'client_api_id': client_api_id}
+        self._session = self._create_session()
+
+    @staticmethod
+    def _create_session():
+        # Only idempotent methods are retried, and the final response is
+        # returned rather than raised so _http_call can report the error.
+        retries = Retry(total=3,
+                        backoff_factor=0.5,
+                        status_forcelist=(502, 503, 504),
+                        raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=DEFAULT_POOL_SIZE,
+                              pool_maxsize=DEFAULT_POOL_SIZE,
+                              max_retries=retries)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
 
     def _http_call(self, method, uri, data=None, additional_params=None):
         url = self._endpoint + uri
@@ -22,7 +58,12 @@ class HTTPClient:
         if data is None:
             post_data = None
         elif type(data) is dict:
-            post_data = json.dumps(data)
+            # Compact separators keep large schemas as small as possible,
+            # orjson output is always compact.
+            if orjson:
+                post_data = orjson.dumps(data)
+            else:
+                post_data = json.dumps(data, separators=(',', ':'))
         elif type(data) is str:
             post_data = data
         else:
@@ -30,19 +71,26 @@ class HTTPClient:
                 "data must either be dict or string (i.e. JSON)"
             )
 
-        http_call = getattr(requests, method)
-        call_params = self._params
+        # Copy so params for this call aren't kept for later (or concurrent)
+        # calls
+        call_params = dict(self._params)
         if additional_params:
             call_params.update(additional_params)
         logger.debug("{} {} with params: {}".format(method.upper(),
                                                     url,
                                                     call_params))
         if data:
-            logger.debug("{} Data: {}".format(method.upper(), post_data))
-        response = http_call(url,
-                             params=call_params,
-                             headers=self._headers,
-                             data=post_data)
+            # orjson encodes to bytes
+            if type(post_data) is bytes:
+                log_data = post_data.decode()
+            else:
+                log_data = post_data
+            logger.debug("{} Data: {}".format(method.upper(), log_data))
+        response = self._session.request(method,
+                                         url,
+                                         params=call_params,
+                                         headers=self._headers,
+                                         data=post_data)
 
         # Sometimes in error conditions valid json is not returned
         try:
@@ -51,10 +99,13 @@ class HTTPClient:
             response_message = response.text
 
         if response.status_code < 200 or response.status_code > 299:
-            raise RuntimeError(
+            raise HTTPError(
                 ('Request to {} failed! HTTP Error Code: {} '
                  'Response: {}').format(
-                    url, response.status_code, response_message))
+                    url, response.status_code, response_message),
+                response.status_code,
+                response_message
+            )
 
         if response_message:
             logger.debug(
@@ -62,6 +113,10 @@ class HTTPClient:
             )
             return response_message
 
+    def close(self):
+        """Closes the pooled connections to the CloudHealth API"""
+        self._session.close()
+
     def delete(self, uri, params=None):
         return self._http_call('delete', uri, additional_params=params)
 
@@ -99,3 +154,6 @@ class CloudHealthClient:
                      client_api_id=client_api_id
         )
 
+    def close(self):
+        self._http_client.close()
+
@@ -4,11 +4,13 @@ import json
 import logging
 import sys
 
-import yaml
-
 from chtools.cli.handler import CliHandler
 from chtools.perspective.client import PerspectiveClient
-from chtools.cli.file import read_schema_file, read_spec_file
+from chtools.cli.file import (
+    read_schema_file,
+    read_spec_file,
+    read_spec_files
+)
 
 logger = logging.getLogger(__name__)
 
@@ -27,16 +29,40 @@ class PerspectiveCliHandler(CliHandler):
             log_level=log_level
         )
 
-    def _create(self):
-        if self._client.check_exists(self._args.name):
-            raise RuntimeError(
-                "Perspective with name {} already exists, use 'update' if "
-                "you'd like to update the perspective, otherwise use a "
-                "different name. ".format(self._args.name)
-            )
+    def _bulk(self, action, specs):
+        results = self._client.bulk([(action, spec) for spec in specs])
+        past_tense = {'create': 'Created', 'update': 'Updated'}
+        lines = []
+        failed = False
+        for spec, result in zip(specs, results):
+            if isinstance(result, Exception):
+                failed = True
+                lines.append(
+                    "Failed to {} Perspective {}: {}".format(action,
+                                                             spec['name'],
+                                                             result)
+                )
+            else:
+                lines.append(
+                    "{} Perspective {} "
+                    "(https://apps.cloudhealthtech.com/perspectives/{})".format(
+                        past_tense[action],
+                        result.name,
+                        result.id
+                    )
+                )
+
+        results = "\n".join(lines)
+        if failed:
+            raise RuntimeError(results)
+        return results
 
+    def _create(self):
         if self._args.spec_file:
-            spec = read_spec_file(self._args.spec_file)
+            specs = read_spec_files(self._args.spec_file)
+            if len(specs) > 1:
+                return self._bulk('create', specs)
+            spec = specs[0]
             perspective = self._client.create(spec['name'], spec=spec)
         elif self._args.schema_file:
             schema = read_schema_file(self._args.schema_file)
@@ -108,7 +134,10 @@ class PerspectiveCliHandler(CliHandler):
                                  " spec or schema file.")
         parser.add_argument('--spec-file',
                             help="Path to the file containing YAML spec used "
-                                 "to create or update the perspective.")
+                                 "to create or update the perspective. May "
+                                 "also be a file with a list of specs or a "
+                                 "directory of spec files to create or "
+                                 "update several perspectives at once.")
         parser.add_argument('--schema-file',
                             help="Path to the file containing JSON schema "
                                  "used to create or update the perspective.")
@@ -174,13 +203,14 @@ class PerspectiveCliHandler(CliHandler):
 
     @staticmethod
     def _read_spec_file(file_path):
-        with open(file_path) as spec_file:
-            spec = yaml.load(spec_file)
-        return spec
+        return read_spec_file(file_path)
 
     def _update(self):
         if self._args.spec_file:
-            spec = read_spec_file(self._args.spec_file)
+            specs = read_spec_files(self._args.spec_file)
+            if len(specs) > 1:
+                return self._bulk('update', specs)
+            spec = specs[0]
             perspective = self._client.update(spec['name'], spec=spec)
         else:
             schema = read_schema_file(self._args.schema_file)
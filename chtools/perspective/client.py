@@ -1,15 +1,34 @@
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from chtools.cloudhealth.client import CloudHealthClient
 from chtools.perspective.data import Perspective
 
 logger = logging.getLogger(__name__)
 
+# Number of seconds a retrieved perspective index is reused before it is
+# fetched from CloudHealth again.
+DEFAULT_INDEX_CACHE_TTL = 30
+# Number of perspectives created or updated at the same time by bulk
+DEFAULT_BULK_WORKERS = 8
+
 
 class PerspectiveClient(CloudHealthClient):
-    def __init__(self, api_key, client_api_id=None):
+    def __init__(self, api_key, client_api_id=None,
+                 index_cache_ttl=DEFAULT_INDEX_CACHE_TTL):
         super().__init__(api_key, client_api_id=client_api_id)
         self._uri = 'v1/perspective_schemas/'
+        self._index_cache_ttl = index_cache_ttl
+        # Tuple of (time retrieved, index response, dict of perspective
+        # name to tuple of (id, info)). Always replaced as a whole so threads
+        # used by bulk see a consistent snapshot.
+        self._index_cache = None
+        self._index_lock = threading.Lock()
+        # Futures of updates made without waiting for them to complete
+        self._pending_updates = []
+        self._pending_updates_lock = threading.Lock()
 
     def _get_perspective_id(self, perspective_input):
         """Returns the perspective id based on input.
@@ -17,38 +36,59 @@ class PerspectiveClient(CloudHealthClient):
         Determines if perspective is an id (i.e. int) or a name. If name will
         make API call to determine it's id
         """
-        try:
-            int(perspective_input)
-            return str(perspective_input)
-        except ValueError:
-            perspectives = self.index()
-            for perspective_id, perspective_info in perspectives.items():
-                if perspective_info['name'] == perspective_input:
-                    return perspective_id
+        perspective_id = str(perspective_input)
+        if perspective_id.isdigit():
+            return perspective_id
+        perspective = self._get_by_name().get(perspective_input)
+        if perspective:
+            return perspective[0]
+
+    def bulk(self, operations, max_workers=DEFAULT_BULK_WORKERS):
+        """Creates or updates several perspectives concurrently
+
+        operations is a list of (action, spec) tuples, where action is either
+        'create' or 'update'. Returns a list containing the resulting
+        Perspective, or the exception raised, for each operation in the same
+        order as operations.
+        """
+        actions = {'create': self.create, 'update': self.update}
+        for action, spec in operations:
+            if action not in actions:
+                raise ValueError(
+                    "Unknown bulk action {}. "
+                    "Valid actions are: create, update".format(action)
+                )
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(actions[action], spec['name'], spec=spec)
+                for action, spec in operations
+            ]
+
+        results = []
+        for future in futures:
+            exception = future.exception()
+            results.append(exception if exception else future.result())
+        return results
 
     def create(self, perspective_name, schema=None, spec=None):
         """Creates perspective. By default schema will be 'empty'. """
-        if not self.check_exists(perspective_name):
-            perspective = Perspective(self._http_client)
+        perspective = Perspective(self._http_client)
+        # Perspective.create raises a RuntimeError if the name is already used
+        try:
             perspective.create(perspective_name,
                                schema=schema,
                                spec=spec)
-        else:
-            raise RuntimeError(
-                "Perspective with name {} already exists.".format(
-                    perspective_name
-                )
-            )
+        finally:
+            self.invalidate_index()
         return perspective
 
     def check_exists(self, name, active=None):
         """Checks if a perspective exists with the same name. Returns bool"""
-        perspectives = self.index(active=active)
-        for perspective_id, perspective_info in perspectives.items():
-            if perspective_info['name'] == name:
-                return True
-        else:
+        perspective = self._get_by_name().get(name)
+        if perspective is None:
             return False
+        return active is None or perspective[1]['active'] == active
 
     def delete(self, perspective_input):
         """Deletes perspective
@@ -58,10 +98,30 @@ class PerspectiveClient(CloudHealthClient):
         perspective_id = self._get_perspective_id(perspective_input)
         perspective = Perspective(self._http_client,
                                   perspective_id=str(perspective_id))
-        perspective.delete()
+        # Perspective is renamed before being deleted, so the index is out
+        # of date even if the delete fails.
+        try:
+            perspective.delete()
+        finally:
+            self.invalidate_index()
         # returned perspective will have schema set to None
         return perspective
 
+    def flush(self):
+        """Waits for all updates made with wait=False to complete
+
+        The first exception raised by any of the updates is raised once all
+        of them are done.
+        """
+        with self._pending_updates_lock:
+            pending_updates = self._pending_updates
+            self._pending_updates = []
+        # exception() blocks until the update is done
+        exceptions = [future.exception() for future in pending_updates]
+        for exception in exceptions:
+            if exception:
+                raise exception
+
     def get(self, perspective_input):
         """Creates Perspective object with data from CloudHealth
 
@@ -81,9 +141,41 @@ class PerspectiveClient(CloudHealthClient):
             )
         return perspective
 
+    def _get_index_cache(self):
+        """Returns tuple of (time retrieved, index response, name index).
+
+        The index is cached for index_cache_ttl seconds so that lookups made
+        during a single action only retrieve it from CloudHealth once.
+        """
+        with self._index_lock:
+            index_cache = self._index_cache
+            if index_cache:
+                fetched_at = index_cache[0]
+                if time.monotonic() - fetched_at < self._index_cache_ttl:
+                    logger.debug("Using cached perspective index")
+                    return index_cache
+
+            # An empty index comes back from the HTTP client as None
+            response = self._http_client.get(self._uri) or {}
+            by_name = {}
+            for perspective_id, perspective_info in response.items():
+                by_name.setdefault(perspective_info['name'],
+                                   (perspective_id, perspective_info))
+            index_cache = (time.monotonic(), response, by_name)
+            self._index_cache = index_cache
+            return index_cache
+
+    def _get_index(self):
+        """Returns the unfiltered perspective index"""
+        return self._get_index_cache()[1]
+
+    def _get_by_name(self):
+        """Returns dict of perspective names to (id, info) tuples"""
+        return self._get_index_cache()[2]
+
     def index(self, active=None):
         """Returns dict of PerspectiveIds, Names and Active Status"""
-        response = self._http_client.get(self._uri)
+        response = self._get_index()
         if active is None:
             perspectives = response
         else:
@@ -94,10 +186,18 @@ class PerspectiveClient(CloudHealthClient):
             }
         return perspectives
 
-    def update(self, perspective_input, schema=None, spec=None):
+    def invalidate_index(self):
+        """Drops the cached index so the next lookup retrieves it again"""
+        with self._index_lock:
+            self._index_cache = None
+
+    def update(self, perspective_input, schema=None, spec=None, wait=True):
         """Updates perspective with specified id, using specified schema
 
         perspective_input can be name or id
+
+        If wait is False CloudHealth is updated in the background, use flush
+        to wait for the update to complete.
         """
         if not schema and not spec:
             raise ValueError(
@@ -126,7 +226,12 @@ class PerspectiveClient(CloudHealthClient):
                 )
             perspective.spec = spec
 
-        perspective.update_cloudhealth()
+        if wait:
+            perspective.update_cloudhealth()
+        else:
+            future = perspective.update_cloudhealth_async()
+            with self._pending_updates_lock:
+                self._pending_updates.append(future)
         return perspective
 
 
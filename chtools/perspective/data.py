@@ -1,18 +1,76 @@
 import copy
 import datetime
 import logging
+import os
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-import yaml
-from deepdiff import DeepDiff
+from chtools.cloudhealth.client import HTTPError
 
 logger = logging.getLogger(__name__)
 
 
+def _schema_ttl_from_env():
+    ttl = os.getenv('CH_SCHEMA_TTL', '0')
+    try:
+        return float(ttl)
+    except ValueError:
+        logger.warning(
+            "CH_SCHEMA_TTL {} is not a number of seconds, schemas will "
+            "not be reused.".format(ttl)
+        )
+        return 0
+
+
+# Number of seconds a schema retrieved from CloudHealth is reused by
+# get_schema. Disabled by default.
+SCHEMA_TTL = _schema_ttl_from_env()
+
+# Schemas retrieved from CloudHealth, shared by all perspectives so that
+# each Perspective object created for the same id can reuse them. Dict of
+# perspective id to tuple of (time retrieved, get_schema response).
+_schema_cache = {}
+_schema_cache_lock = threading.Lock()
+
+# Message CloudHealth responds with when creating a perspective with a name
+# that is already used.
+DUPLICATE_NAME_PATTERN = re.compile(r'already (exists|been taken)',
+                                    re.IGNORECASE)
+
+# Shared by all perspectives for updates made with update_cloudhealth_async.
+# Created by _get_update_executor the first time it's needed so importing the
+# module doesn't start any threads.
+_update_executor = None
+_update_executor_lock = threading.Lock()
+
+
+def _get_update_executor():
+    """Returns the executor used by update_cloudhealth_async"""
+    global _update_executor
+    with _update_executor_lock:
+        if _update_executor is None:
+            _update_executor = ThreadPoolExecutor(max_workers=4)
+        return _update_executor
+
+
 class Perspective:
     def __init__(self, http_client, perspective_id=None):
         # Used to generate ref_id's for new groups.
         self._new_ref_id = 100
+        # Lookups of the groups in the schema. Built the first time they are
+        # needed and reset whenever the schema is replaced (not when it's
+        # edited in place).
+        self._existing_ref_ids = None
+        self._name_to_ref_id = None
+        self._ref_id_to_name = None
+        # Incremented whenever the schema changes, the generated spec is
+        # cached for the current version.
+        self._schema_version = 0
+        # Tuple of (schema version, spec YAML)
+        self._spec_cache = None
+        self._schema = None
         self._http_client = http_client
         self._uri = 'v1/perspective_schemas'
         self._match_lowercase_tag_field = None
@@ -20,7 +78,7 @@ class Perspective:
         # Schema has includes several lists that can only include a single item
         # items that match these keys will be converted to/from a single
         # item list as needed
-        self._single_item_list_keys = ['field', 'tag_field']
+        self._single_item_list_keys = frozenset(['field', 'tag_field'])
 
         if perspective_id:
             # This will set the perspective URL
@@ -62,9 +120,11 @@ class Perspective:
             )
         # If constant doesn't exist, i.e. ref_id is none, then create constant
         else:
+            # Schema was retrieved if needed when looking up the ref_id
+            constants = self._schema['constants']
             # Look through existing constants for the type we are adding.
             # There will always be a 'Static Group' constant.
-            for item in self.schema['constants']:
+            for item in constants:
                 if item['type'] == constant_type:
                     constant = item
                     break
@@ -74,7 +134,7 @@ class Perspective:
                             "type": constant_type,
                             "list": []
                 }
-                self.schema['constants'].append(constant)
+                constants.append(constant)
 
             ref_id = self._get_new_ref_id()
             logger.debug(
@@ -89,25 +149,45 @@ class Perspective:
                 'name': constant_name
             }
             constant['list'].append(new_group)
+            self._name_to_ref_id[constant_name] = ref_id
+            self._ref_id_to_name.setdefault(ref_id, constant_name)
+            self._schema_modified()
 
         return ref_id
 
     def _add_rule(self, rule_definition):
         logger.debug("Adding Rule: {}".format(rule_definition))
         self._schema['rules'].append(rule_definition)
+        self._schema_modified()
 
     def _add_merge(self, merge_definition):
         logger.debug("Adding Merge: {}".format(merge_definition))
         self._schema['merges'].append(merge_definition)
+        self._schema_modified()
 
     def _create_perspective(self):
         # If self.id is set that means we know the perspective already exists
         if not self.id:
             schema_data = {'schema': self._schema}
-            response = self._http_client.post(self._uri, schema_data)
+            # CloudHealth rejects perspectives with a name that is already
+            # used, so rather than checking the index first the error is
+            # translated.
+            try:
+                response = self._http_client.post(self._uri, schema_data)
+            except HTTPError as e:
+                if (400 <= e.status_code < 500
+                        and DUPLICATE_NAME_PATTERN.search(
+                            str(e.response_message))):
+                    raise RuntimeError(
+                        "Perspective with name {} already exists.".format(
+                            self._schema['name']
+                        )
+                    ) from e
+                raise
             perspective_id = response['message'].split(" ")[1]
             self.id = perspective_id
-            self.get_schema()
+            self._invalidate_cached_schema()
+            self._refresh_schema(response)
         else:
             raise RuntimeError(
                 "Perspective with Id {} exists. Use update_cloudhealth "
@@ -135,6 +215,7 @@ class Perspective:
 
         if schema:
             self._schema = schema
+            self._reset_schema_indices()
             self._create_perspective()
         elif spec:
             # If perspective includes merges we will create the perspective
@@ -168,37 +249,79 @@ class Perspective:
         # hard deleted. Rename perspective prior to delete to allow the name
         # to be reused
         timestamp = datetime.datetime.now()
-        self.name = self.name + str(timestamp)
+        self.name = self.name + timestamp.strftime('-deleted-%Y%m%d%H%M%S%f')
         logger.debug(
             "Renaming perspective to {}".format(self.name)
         )
-        self.update_cloudhealth()
+        # No need to get the renamed schema as it's about to be deleted
+        self.update_cloudhealth(refresh=False)
         # hard_delete can cause CloudHealth to return 500 errors if
         # perspective schema gets into a strange state delete_params = {
         # 'force': True, 'hard_delete': True}
         delete_params = {'force': True, 'hard_delete': True}
         response = self._http_client.delete(self._uri, params=delete_params)
+        self._invalidate_cached_schema()
         logger.debug(response)
         self._schema = None
+        self._reset_schema_indices()
 
     def _get_new_ref_id(self):
         """Generates new ref_ids that are not in the current schema"""
-        while True:
+        if self._existing_ref_ids is None:
+            self._build_schema_indices()
+
+        # Check to make sure ref_id isn't already used in schema
+        # If so go to next id
+        self._new_ref_id += 1
+        while str(self._new_ref_id) in self._existing_ref_ids:
             self._new_ref_id += 1
-            # Check to make sure ref_id isn't already used in schema
-            # If so go to next id
-            constants = self.schema['constants']
-            existing_ref_ids = []
-            # These are the types of constant that have ref_ids we care about
-            constant_types = ['Static Group', 'Dynamic Group Block']
-            for constant in constants:
-                if constant['type'] in constant_types:
-                    ref_ids = [item['ref_id'] for item in constant['list']]
-                    existing_ref_ids.extend(ref_ids)
-            if str(self._new_ref_id) not in existing_ref_ids:
-                break
 
-        return str(self._new_ref_id)
+        ref_id = str(self._new_ref_id)
+        self._existing_ref_ids.add(ref_id)
+        return ref_id
+
+    def _build_schema_indices(self):
+        """Builds lookups of the groups in the schema, so that they don't
+        need to be searched for each rule or merge.
+
+        Lookups are kept up to date for groups added by _add_constant and
+        reset when the schema is replaced. Groups edited in place in the
+        dict returned by schema aren't reflected.
+        """
+        self._existing_ref_ids = set()
+        self._name_to_ref_id = {}
+        self._ref_id_to_name = {}
+        # Only Static Groups and Dynamic Group Blocks are used for new ref_ids
+        # and name lookups, Dynamic Groups are included for ref_id lookups.
+        group_types = ['Static Group', 'Dynamic Group Block']
+        for constant in self.schema['constants']:
+            constant_type = constant['type']
+            if (constant_type not in group_types
+                    and constant_type != 'Dynamic Group'):
+                continue
+            for item in constant['list']:
+                if constant_type in group_types:
+                    self._existing_ref_ids.add(item['ref_id'])
+                if item.get('is_other'):
+                    continue
+                # First match wins, same as searching the constants in order
+                self._ref_id_to_name.setdefault(item['ref_id'], item['name'])
+                if constant_type in group_types:
+                    self._name_to_ref_id.setdefault(item['name'],
+                                                    item['ref_id'])
+
+    def _reset_schema_indices(self):
+        """Drops lookups built from the schema. Called when the schema is
+        replaced."""
+        self._existing_ref_ids = None
+        self._name_to_ref_id = None
+        self._ref_id_to_name = None
+        self._schema_modified()
+
+    def _schema_modified(self):
+        """Invalidates the cached spec. Called whenever the schema is
+        changed."""
+        self._schema_version += 1
 
     def _get_constant_by_name(self, constant_name, constant_type):
         """Returns the constant clause (i.e. group) for a specified name"""
@@ -248,11 +371,9 @@ class Perspective:
     def _get_name_by_ref_id(self, ref_id):
         """Returns the name of a constant (i.e. group) with a specified ref_id
         """
-        constant = self._get_constant_by_ref_id(ref_id)
-        if constant:
-            return constant['name']
-        else:
-            return None
+        if self._ref_id_to_name is None:
+            self._build_schema_indices()
+        return self._ref_id_to_name.get(ref_id)
 
     def _get_ref_id_by_name(self, constant_name, dynamic_group_block=None):
         """Returns the ref_id of a constant (i.e. group) with a specified name
@@ -266,10 +387,9 @@ class Perspective:
         them.
         """
         if not dynamic_group_block:
-            constants_list = []
-            for constant in self.schema['constants']:
-                if constant['type'] in ["Static Group", "Dynamic Group Block"]:
-                    constants_list.extend(constant['list'])
+            if self._name_to_ref_id is None:
+                self._build_schema_indices()
+            return self._name_to_ref_id.get(constant_name)
         else:
             for constant in self.schema['constants']:
                 if constant['type'] == "Dynamic Group Block":
@@ -305,8 +425,48 @@ class Perspective:
         return None
 
     def get_schema(self):
-        """gets the latest schema from CloudHealth"""
-        response = self._http_client.get(self._uri)
+        """gets the latest schema from CloudHealth
+
+        A schema retrieved for the same perspective id within SCHEMA_TTL
+        seconds is reused, unless it has since been updated or deleted.
+        """
+        response = None
+        if SCHEMA_TTL and self.id:
+            with _schema_cache_lock:
+                cached = _schema_cache.get(self.id)
+            if cached and time.monotonic() - cached[0] < SCHEMA_TTL:
+                logger.debug("Using schema retrieved within SCHEMA_TTL")
+                response = cached[1]
+
+        if response is None:
+            response = self._http_client.get(self._uri)
+            if SCHEMA_TTL and self.id:
+                with _schema_cache_lock:
+                    _schema_cache[self.id] = (time.monotonic(), response)
+
+        # Cached response is shared, so each perspective gets its own copy
+        # to modify.
+        if SCHEMA_TTL and self.id:
+            response = copy.deepcopy(response)
+        self._set_schema_from_response(response)
+
+    def _invalidate_cached_schema(self):
+        """Drops the shared cached schema after changing CloudHealth"""
+        with _schema_cache_lock:
+            _schema_cache.pop(self.id, None)
+
+    def _refresh_schema(self, response):
+        """Sets schema after a create or update.
+
+        Uses the schema included in the response if CloudHealth returned one,
+        otherwise gets the schema from CloudHealth.
+        """
+        if type(response) is dict and response.get('schema'):
+            self._set_schema_from_response(response)
+        else:
+            self.get_schema()
+
+    def _set_schema_from_response(self, response):
         schema = response['schema']
 
         # If the perspective has Dynamic Groups then sometimes crud and other
@@ -337,6 +497,7 @@ class Perspective:
             dynamic_group_block['list'] = valid_dynamic_groups
 
         self._schema = response['schema']
+        self._reset_schema_indices()
 
     @property
     def id(self):
@@ -355,6 +516,7 @@ class Perspective:
     @include_in_reports.setter
     def include_in_reports(self, toggle):
         self._schema['include_in_reports'] = toggle
+        self._schema_modified()
 
     @property
     def name(self):
@@ -364,6 +526,7 @@ class Perspective:
     @name.setter
     def name(self, new_name):
         self._schema['name'] = new_name
+        self._schema_modified()
 
     @property
     def match_lowercase_tag_field(self):
@@ -379,6 +542,7 @@ class Perspective:
 
         """
         self._match_lowercase_tag_field = bool(value)
+        self._schema_modified()
 
     @property
     def match_lowercase_tag_val(self):
@@ -394,9 +558,17 @@ class Perspective:
 
         """
         self._match_lowercase_tag_val = bool(value)
+        self._schema_modified()
 
     @property
     def schema(self):
+        """Schema of the perspective.
+
+        Changes should be made via the setters (e.g. name, spec) or by
+        assigning a new schema, i.e. perspective.schema = schema. Editing the
+        returned dict in place isn't seen by the cached spec or the group
+        lookups built from the schema.
+        """
         if not self._schema:
             self.get_schema()
 
@@ -405,23 +577,39 @@ class Perspective:
     @schema.setter
     def schema(self, schema_input):
         self._schema = schema_input
+        self._reset_schema_indices()
 
     def _spec_from_schema(self):
-        """Spec is never stored, but always generated on the fly based on
-        current schema"""
-        spec_dict = copy.deepcopy(self._schema)
-        for rule in spec_dict['rules']:
+        """Generates the spec dict from the current schema.
+
+        The spec property caches the YAML generated from this until the
+        schema is changed through the Perspective.
+        """
+        # deepdiff is slow to import and only needed for generating specs
+        from deepdiff import DeepDiff
+
+        single_item_list_keys = self._single_item_list_keys
+        get_name_by_ref_id = self._get_name_by_ref_id
+
+        # Only the rules, and their conditions, are modified. So those are
+        # copied rather than copying the entire schema.
+        spec_dict = {
+            key: value for key, value in self._schema.items()
+            if key not in ['rules', 'merges', 'constants']
+        }
+        spec_dict['rules'] = []
+        for schema_rule in self._schema['rules']:
+            rule = dict(schema_rule)
             # categorize schema uses 'ref_id' instead of 'to'
             # we switch it to 'to' so it's consistent with the filter
             # rules and makes it easier to understand
             if rule.get('ref_id'):
-                rule['to'] = rule['ref_id']
-                del rule['ref_id']
-            rule['to'] = self._get_name_by_ref_id(rule['to'])
+                rule['to'] = rule.pop('ref_id')
+            rule['to'] = get_name_by_ref_id(rule['to'])
             # categorize don't have conditions and or nested dicts
-            for key, value in rule.items():
-                if (key in self._single_item_list_keys
-                        and type(value) is list):
+            for key in single_item_list_keys.intersection(rule):
+                value = rule[key]
+                if type(value) is list:
                     if len(value) != 1:
                         raise RuntimeError(
                             "Expected {} in {} to have list "
@@ -430,16 +618,21 @@ class Perspective:
                     rule[key] = value[0]
             # filter rules have conditions that need to checked
             if rule.get('condition'):
-                for clause in rule['condition']['clauses']:
-                    for key, value in clause.items():
-                        if (key in self._single_item_list_keys
-                                and type(value) is list):
+                condition = rule['condition'] = dict(rule['condition'])
+                clauses = condition['clauses'] = [
+                    dict(clause) for clause in condition['clauses']
+                ]
+                for clause in clauses:
+                    for key in single_item_list_keys.intersection(clause):
+                        value = clause[key]
+                        if type(value) is list:
                             if len(value) != 1:
                                 raise RuntimeError(
                                     "Expected {} in {} to have list "
                                     "with just 1 item.".format(key, clause)
                                 )
                             clause[key] = value[0]
+            spec_dict['rules'].append(rule)
 
         # Combine rules that only differ by asset into a single rule
         # asset key will include a list of assets from each rule that was
@@ -479,7 +672,7 @@ class Perspective:
         spec_dict['rules'] = combined_rules
 
         merges = []
-        for merge_clause in spec_dict['merges']:
+        for merge_clause in self._schema['merges']:
             to_group = self._get_constant_by_ref_id(merge_clause['to'])
             from_groups = [
                 self._get_name_by_ref_id(ref_id) for ref_id
@@ -497,10 +690,7 @@ class Perspective:
 
         if merges:
             spec_dict['merges'] = merges
-        else:
-            del spec_dict['merges']
 
-        del spec_dict['constants']
         return spec_dict
 
     def _spec_merge_to_schema(self, merge_spec):
@@ -604,12 +794,13 @@ class Perspective:
         clause. The other part is setting the 'fwd_to' key for each constant
         that is merged. This function goes through the merges clause and
         sets (or unsets) the 'fwd_to' as appropriate."""
+        schema = self.schema
         merge_mapping = {}
-        for merge in self.schema['merges']:
+        for merge in schema['merges']:
             for from_ref_id in merge['from']:
                 merge_mapping[from_ref_id] = merge['to']
 
-        for constant_clause in self.schema['constants']:
+        for constant_clause in schema['constants']:
             if constant_clause['type'] == 'Dynamic Group':
                 dynamic_groups = constant_clause['list']
                 break
@@ -672,23 +863,25 @@ class Perspective:
 
         # Include matching on lower case tag values and/or
         # lower case tag field name if options are set
+        match_lowercase_tag_val = self.match_lowercase_tag_val
+        match_lowercase_tag_field = self.match_lowercase_tag_field
         if rule['type'] == 'filter':
 
             clauses = rule['condition']['clauses']
 
-            if self.match_lowercase_tag_val:
+            if match_lowercase_tag_val:
                 clauses = self._match_lowercase_clauses(
                     clauses,
                     'val'
                 )
 
-            if self.match_lowercase_tag_field:
+            if match_lowercase_tag_field:
                 clauses = self._match_lowercase_clauses(
                     clauses,
                     'tag_field'
                 )
 
-            if self.match_lowercase_tag_val or self.match_lowercase_tag_field:
+            if match_lowercase_tag_val or match_lowercase_tag_field:
                 if len(clauses) > 1:
                     combine_with = rule['condition'].get('combine_with')
                     if combine_with is None:
@@ -702,18 +895,19 @@ class Perspective:
                             "supported combine_with: {}".format(rule)
                         )
 
-        # Convert to single item lists where needed
+        # Convert to single item lists where needed. Only the keys that
+        # need converting are looked at rather than every key.
         # categorize don't have conditions and or nested dicts
-        for key, value in rule.items():
-            if key in self._single_item_list_keys and type(value) is str:
-                rule[key] = [value]
+        single_item_list_keys = self._single_item_list_keys
+        for key in single_item_list_keys.intersection(rule):
+            if type(rule[key]) is str:
+                rule[key] = [rule[key]]
         # filter rules have conditions that need to checked
         if rule.get('condition'):
             for clause in rule['condition']['clauses']:
-                for key, value in clause.items():
-                    if (key in self._single_item_list_keys
-                            and type(value) is str):
-                        clause[key] = [value]
+                for key in single_item_list_keys.intersection(clause):
+                    if type(clause[key]) is str:
+                        clause[key] = [clause[key]]
 
         self._add_rule(rule)
 
@@ -739,13 +933,30 @@ class Perspective:
 
     @property
     def spec(self):
+        """YAML spec generated from the schema.
+
+        The YAML is cached until the schema is changed via the setters or
+        replaced. Edits made in place to the dict returned by schema don't
+        invalidate it.
+        """
+        if self._spec_cache and self._spec_cache[0] == self._schema_version:
+            return self._spec_cache[1]
+
         spec_dict = self._spec_from_schema()
         if self.match_lowercase_tag_field:
             spec_dict[
                 'match_lowercase_tag_field'] = self.match_lowercase_tag_field
         if self.match_lowercase_tag_val:
             spec_dict['match_lowercase_tag_val'] = self.match_lowercase_tag_val
-        spec_yaml = yaml.dump(spec_dict, default_flow_style=False)
+        # Imported here as yaml is only needed for generating specs
+        import yaml
+
+        # Use the libyaml based dumper when PyYAML has been built with it
+        dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+        spec_yaml = yaml.dump(spec_dict,
+                              Dumper=dumper,
+                              default_flow_style=False)
+        self._spec_cache = (self._schema_version, spec_yaml)
         return spec_yaml
 
     @spec.setter
@@ -765,8 +976,10 @@ class Perspective:
             self.match_lowercase_tag_val = spec_input[
                 'match_lowercase_tag_val'
             ]
+        schema = self.schema
         # Remove all existing rules, they will be "over written" by the spec
-        self.schema['rules'] = []
+        schema['rules'] = []
+        self._schema_modified()
         for rule in spec_input['rules']:
             # Expand rule that contains multiple assets into multiple rules
             if type(rule['asset']) is list:
@@ -782,7 +995,8 @@ class Perspective:
                 self._spec_rule_to_schema(rule)
 
         # Remove all existing merges, they will be "over written" by the spec
-        self.schema['merges'] = []
+        schema['merges'] = []
+        self._schema_modified()
         for merge in spec_input.get('merges', []):
             # Dynamic Group Block must be created by CloudHealth before merges
             # can be defined.
@@ -805,16 +1019,32 @@ class Perspective:
             self._spec_merge_to_schema(merge)
         self._set_constant_fwd_to()
 
-    def update_cloudhealth(self):
-        """Updates cloud with objects state or with provided schema"""
+    def update_cloudhealth(self, refresh=True):
+        """Updates cloud with objects state or with provided schema
+
+        If refresh is False the schema is not updated with the schema as
+        saved by CloudHealth.
+        """
         if self.id:
             schema_data = {'schema': self.schema}
 
             response = self._http_client.put(self._uri,
                                              schema_data)
-            self.get_schema()
+            self._invalidate_cached_schema()
+            if refresh:
+                self._refresh_schema(response)
         else:
             raise RuntimeError(
                 "Perspective Id must be set to update_cloudhealth a "
                 "perspective"
             )
+
+    def update_cloudhealth_async(self, schema=None):
+        """Updates cloud in the background, optionally with provided schema
+
+        Returns a concurrent.futures.Future that is done once CloudHealth has
+        been updated. The perspective shouldn't be modified until then.
+        """
+        if schema:
+            self.schema = schema
+        return _get_update_executor().submit(self.update_cloudhealth)
@@ -23,6 +23,9 @@ setup(name='chtools',
             'requests==2.20.0',
             'urllib3==1.23'
       ],
+      extras_require={
+            'orjson': ['orjson']
+      },
       setup_requires=['pytest-runner'],
       tests_require=['pytest'],
       entry_points={
@@ -15,7 +15,6 @@ def test_create(mock_client, mock_perspective):
     perspective.name = 'tag_filter'
     perspective.id = '1234567890'
 
-    mock_client.return_value.check_exists.return_value = False
     mock_client.return_value.create.return_value = perspective
 
     args = ['create', '--spec-file', 'tests/perspective_data/specs/tag_filter.yaml']
@@ -28,6 +27,36 @@ def test_create(mock_client, mock_perspective):
     assert handler._results == "Created Perspective tag_filter (https://apps.cloudhealthtech.com/perspectives/1234567890)"
 
 
+@patch('chtools.perspective.client.PerspectiveClient')
+def test_create_from_spec_directory(mock_client, tmpdir):
+    for name in ['tag_filter', 'tag_search']:
+        spec_path = 'tests/perspective_data/specs/{}.yaml'.format(name)
+        with open(spec_path) as spec_file:
+            tmpdir.join('{}.yaml'.format(name)).write(spec_file.read())
+
+    perspective = Perspective(None)
+    perspective.name = 'tag_filter'
+    perspective.id = '1234567890'
+    mock_client.return_value.bulk.return_value = [
+        perspective, RuntimeError("Perspective with name tag_search already exists.")
+    ]
+
+    args = ['create', '--spec-file', str(tmpdir)]
+    handler = PerspectiveCliHandler(
+        args,
+        'fake_api_key',
+        client=mock_client
+    )
+    with pytest.raises(RuntimeError) as e:
+        handler.execute()
+    assert str(e.value) == (
+        "Created Perspective tag_filter (https://apps.cloudhealthtech.com/perspectives/1234567890)\n"
+        "Failed to create Perspective tag_search: Perspective with name tag_search already exists."
+    )
+    operations = mock_client.return_value.bulk.call_args[0][0]
+    assert [action for action, spec in operations] == ['create', 'create']
+
+
 def test_create_with_name():
     args = ['create', '--spec-file', 'tests/perspective_data/specs/tag_filter.yaml',
             '--name', 'perspective_name']
@@ -1,23 +1,144 @@
+import re
+import threading
+
 import pytest
 import requests_mock
 
+import chtools.perspective.data
 from chtools.perspective.client import PerspectiveClient
 
 
-def test_create():
+def test_bulk():
+    client = PerspectiveClient('fake_api_key')
+
+    create_mock_response = {'message': 'Perspective 2954937502939 created'}
+
+    get_schema_response = {
+        'schema': {'name': 'tag_filter', 'include_in_reports': 'true',
+                   'rules': [], 'merges': [], 'constants': [
+                {'type': 'Static Group', 'list': [
+                    {'ref_id': '2954937634073', 'name': 'Other',
+                     'is_other': 'true'}]}]}}
+
+    duplicate_mock_response = {'error': 'Name has already been taken'}
+
+    operations = [
+        ('create', {'name': 'tag_filter', 'rules': []}),
+        ('create', {'name': 'BCT Customers', 'rules': []})
+    ]
+
+    with requests_mock.Mocker() as m:
+        m.post('https://chapi.cloudhealthtech.com/v1/perspective_schemas',
+               json=create_mock_response)
+        m.post('https://chapi.cloudhealthtech.com/v1/perspective_schemas',
+               json=duplicate_mock_response,
+               status_code=422,
+               additional_matcher=lambda request: (
+                   'BCT Customers' in request.text
+               ))
+        m.get('https://chapi.cloudhealthtech.com/v1/perspective_schemas/2954937502939',
+              json=get_schema_response)
+        results = client.bulk(operations)
+
+    assert results[0].id == '2954937502939'
+    assert str(results[1]) == "Perspective with name BCT Customers already exists."
+
+
+def test_bulk_mixed_create_and_update():
     client = PerspectiveClient('fake_api_key')
 
-    # create will check if perspective with same name exists. So need to mock
-    # index as well.
     index_mock_response = {
-        '2954937501756': {
-            'name': 'BCT - Accounts by Billing Account', 'active': True
-        },
-        '343598849467': {
-            'name': 'BCT Customers', 'active': True
-        }
+        str(2954937500000 + i): {'name': 'p{}'.format(i), 'active': True}
+        for i in range(8)
     }
 
+    def schema_response(request, context):
+        perspective_id = request.path.rsplit('/', 1)[1]
+        if perspective_id == '2954937600000':
+            name = 'new'
+        else:
+            name = index_mock_response[perspective_id]['name']
+        return {'schema': {'name': name, 'include_in_reports': 'true',
+                           'rules': [], 'merges': [], 'constants': [
+                        {'type': 'Static Group', 'list': [
+                            {'ref_id': '2954937634073', 'name': 'Other',
+                             'is_other': 'true'}]}]}}
+
+    operations = []
+    for i in range(8):
+        operations.append(('create', {'name': 'new', 'rules': []}))
+        operations.append(
+            ('update', {'name': 'p{}'.format(i), 'rules': []})
+        )
+
+    with requests_mock.Mocker() as m:
+        m.get('https://chapi.cloudhealthtech.com/v1/perspective_schemas/',
+              json=index_mock_response)
+        m.post('https://chapi.cloudhealthtech.com/v1/perspective_schemas',
+               json={'message': 'Perspective 2954937600000 created'})
+        m.get(re.compile('https://chapi.cloudhealthtech.com/v1/'
+                         'perspective_schemas/[0-9]+'),
+              json=schema_response)
+        m.put(re.compile('https://chapi.cloudhealthtech.com/v1/'
+                         'perspective_schemas/[0-9]+'),
+              json={'message': 'Perspective updated'})
+        results = client.bulk(operations)
+
+    for (action, spec), result in zip(operations, results):
+        assert not isinstance(result, Exception), result
+        assert result.name == spec['name']
+
+
+def test_index_fetched_once_by_concurrent_lookups():
+    client = PerspectiveClient('fake_api_key')
+
+    index_mock_response = {
+        '343598849467': {'name': 'BCT Customers', 'active': True}
+    }
+
+    fetch_started = threading.Event()
+    release_fetch = threading.Event()
+    get_calls = []
+
+    def blocking_get(uri, params=None):
+        get_calls.append(uri)
+        fetch_started.set()
+        release_fetch.wait(5)
+        return index_mock_response
+
+    client._http_client.get = blocking_get
+    results = {}
+
+    def lookup(key):
+        results[key] = client._get_perspective_id('BCT Customers')
+
+    first = threading.Thread(target=lookup, args=('first',))
+    first.start()
+    assert fetch_started.wait(5)
+    # While the first lookup is retrieving the index the second one has to
+    # wait for it rather than retrieving the index again.
+    second = threading.Thread(target=lookup, args=('second',))
+    second.start()
+    second.join(0.2)
+    assert second.is_alive()
+    release_fetch.set()
+    first.join(5)
+    second.join(5)
+
+    assert len(get_calls) == 1
+    assert results == {'first': '343598849467', 'second': '343598849467'}
+
+
+def test_bulk_unknown_action():
+    client = PerspectiveClient('fake_api_key')
+    with pytest.raises(ValueError) as e:
+        client.bulk([('delete', {'name': 'tag_filter'})])
+    assert str(e.value) == "Unknown bulk action delete. Valid actions are: create, update"
+
+
+def test_create():
+    client = PerspectiveClient('fake_api_key')
+
     create_mock_response = {'message': 'Perspective 2954937502939 created'}
 
     # create will retrieve the schema for the new perspective
@@ -29,8 +150,6 @@ def test_create():
                      'is_other': 'true'}]}]}}
 
     with requests_mock.Mocker() as m:
-        m.get('https://chapi.cloudhealthtech.com/v1/perspective_schemas/',
-              json=index_mock_response)
         m.post('https://chapi.cloudhealthtech.com/v1/perspective_schemas',
                json=create_mock_response)
         m.get('https://chapi.cloudhealthtech.com/v1/perspective_schemas/2954937502939',
@@ -41,6 +160,54 @@ def test_create():
     assert perspective.id == '2954937502939'
 
 
+def test_create_duplicate():
+    client = PerspectiveClient('fake_api_key')
+
+    with requests_mock.Mocker() as m:
+        m.post('https://chapi.cloudhealthtech.com/v1/perspective_schemas',
+               json={'error': 'Name has already been taken'},
+               status_code=422)
+        with pytest.raises(RuntimeError) as e:
+            client.create('tag_filter')
+        assert str(e.value) == "Perspective with name tag_filter already exists."
+
+
+def test_create_server_error():
+    client = PerspectiveClient('fake_api_key')
+
+    # Only a 4xx response about the name is treated as a duplicate
+    with requests_mock.Mocker() as m:
+        m.post('https://chapi.cloudhealthtech.com/v1/perspective_schemas',
+               json={'error': 'Request already in progress'},
+               status_code=500)
+        with pytest.raises(RuntimeError) as e:
+            client.create('tag_filter')
+        assert 'HTTP Error Code: 500' in str(e.value)
+
+
+def test_create_schema_in_response():
+    client = PerspectiveClient('fake_api_key')
+
+    # When CloudHealth includes the schema in the response it is used
+    # instead of retrieving the schema again
+    create_mock_response = {
+        'message': 'Perspective 2954937502939 created',
+        'schema': {'name': 'tag_filter', 'include_in_reports': 'true',
+                   'rules': [], 'merges': [], 'constants': [
+                {'type': 'Static Group', 'list': [
+                    {'ref_id': '2954937634073', 'name': 'Other',
+                     'is_other': 'true'}]}]}}
+
+    with requests_mock.Mocker() as m:
+        m.post('https://chapi.cloudhealthtech.com/v1/perspective_schemas',
+               json=create_mock_response)
+        perspective = client.create('tag_filter')
+        assert m.call_count == 1
+
+    assert perspective.id == '2954937502939'
+    assert perspective.name == 'tag_filter'
+
+
 def test_delete():
     client = PerspectiveClient('fake_api_key')
 
@@ -95,10 +262,47 @@ def test_delete():
                  json=delete_perspective_mock_response)
         # Returns a Perspective object
         result = client.delete('tag_filter')
+        # Schema isn't retrieved again after being renamed
+        methods = [request.method for request in m.request_history]
+        assert methods == ['GET', 'GET', 'PUT', 'DELETE']
+        renamed = m.request_history[2].json()['schema']['name']
+        assert renamed.startswith('tag_filter-deleted-')
 
     assert result._schema is None
 
 
+def test_delete_failure_invalidates_index():
+    client = PerspectiveClient('fake_api_key')
+
+    index_mock_response = {
+        '2954937502942': {
+            'name': 'tag_filter', 'active': True
+        }
+    }
+
+    get_schema_mock_response = {
+        'schema': {'name': 'tag_filter', 'include_in_reports': 'true',
+                   'rules': [], 'merges': [], 'constants': [
+                {'type': 'Static Group', 'list': [
+                    {'ref_id': '2954937634083', 'name': 'Other',
+                     'is_other': 'true'}]}]}}
+
+    with requests_mock.Mocker() as m:
+        m.get('https://chapi.cloudhealthtech.com/v1/perspective_schemas/',
+              json=index_mock_response)
+        m.get('https://chapi.cloudhealthtech.com/v1/perspective_schemas/2954937502942',
+              json=get_schema_mock_response)
+        m.put('https://chapi.cloudhealthtech.com/v1/perspective_schemas/2954937502942',
+              json={'message': 'Perspective 2954937502942 updated'})
+        m.delete('https://chapi.cloudhealthtech.com/v1/perspective_schemas/2954937502942',
+                 json={'error': 'Internal error'},
+                 status_code=500)
+        with pytest.raises(RuntimeError):
+            client.delete('tag_filter')
+
+    assert client._index_cache is None
+
+
 def test_get():
     client = PerspectiveClient('fake_api_key')
 
@@ -145,6 +349,29 @@ def test_get():
     assert result.name == 'tag_filter'
 
 
+def test_get_schema_ttl(monkeypatch):
+    monkeypatch.setattr(chtools.perspective.data, 'SCHEMA_TTL', 60)
+    monkeypatch.setattr(chtools.perspective.data, '_schema_cache', {})
+    client = PerspectiveClient('fake_api_key')
+
+    get_schema_mock_response = {
+        'schema': {'name': 'tag_filter', 'include_in_reports': 'true',
+                   'rules': [], 'merges': [], 'constants': [
+                {'type': 'Static Group', 'list': [
+                    {'ref_id': '2954937634083', 'name': 'Other',
+                     'is_other': 'true'}]}]}}
+
+    with requests_mock.Mocker() as m:
+        m.get('https://chapi.cloudhealthtech.com/v1/perspective_schemas/2954937502943',
+              json=get_schema_mock_response)
+        first = client.get('2954937502943')
+        second = client.get('2954937502943')
+        assert m.call_count == 1
+
+    assert first.name == second.name == 'tag_filter'
+    assert first.schema is not second.schema
+
+
 def test_index():
     client = PerspectiveClient('fake_api_key')
 
@@ -165,6 +392,56 @@ def test_index():
     assert result.get('2954937501756')
 
 
+def test_index_cached():
+    client = PerspectiveClient('fake_api_key')
+
+    mock_response = {
+        '2954937501756': {
+            'name': 'BCT - Accounts by Billing Account', 'active': True
+        },
+        '343598849467': {
+            'name': 'BCT Customers', 'active': False
+        }
+    }
+
+    with requests_mock.Mocker() as m:
+        m.get('https://chapi.cloudhealthtech.com/v1/perspective_schemas/',
+              json=mock_response)
+        client.index()
+        active = client.index(active=True)
+        assert m.call_count == 1
+        client.invalidate_index()
+        client.index()
+        assert m.call_count == 2
+
+    assert list(active.keys()) == ['2954937501756']
+
+
+def test_check_exists():
+    client = PerspectiveClient('fake_api_key')
+
+    mock_response = {
+        '2954937501756': {
+            'name': 'BCT - Accounts by Billing Account', 'active': True
+        },
+        '343598849467': {
+            'name': 'BCT Customers', 'active': False
+        }
+    }
+
+    with requests_mock.Mocker() as m:
+        m.get('https://chapi.cloudhealthtech.com/v1/perspective_schemas/',
+              json=mock_response)
+        assert client.check_exists('BCT Customers')
+        assert not client.check_exists('BCT Customers', active=True)
+        assert client.check_exists('BCT Customers', active=False)
+        assert not client.check_exists('tag_filter')
+        assert client._get_perspective_id('BCT Customers') == '343598849467'
+        assert client._get_perspective_id(343598849467) == '343598849467'
+        assert client._get_perspective_id('unknown') is None
+        assert m.call_count == 1
+
+
 def test_update():
     client = PerspectiveClient('fake_api_key')
 
@@ -257,6 +534,42 @@ def test_update():
     assert len(rules) == 4
 
 
+def test_update_no_wait():
+    client = PerspectiveClient('fake_api_key')
+
+    index_mock_response = {
+        '2954937502943': {
+            'name': 'tag_filter', 'active': True
+        }
+    }
+
+    get_schema_mock_response = {
+        'schema': {'name': 'tag_filter', 'include_in_reports': 'true',
+                   'rules': [], 'merges': [], 'constants': [
+                {'type': 'Static Group', 'list': [
+                    {'ref_id': '2954937634083', 'name': 'Other',
+                     'is_other': 'true'}]}]}}
+
+    update_schema_mock_response = {
+        'message': 'Perspective 2954937502943 updated'
+    }
+
+    with requests_mock.Mocker() as m:
+        m.get('https://chapi.cloudhealthtech.com/v1/perspective_schemas/',
+              json=index_mock_response)
+        m.get('https://chapi.cloudhealthtech.com/v1/perspective_schemas/2954937502943',
+              json=get_schema_mock_response)
+        m.put('https://chapi.cloudhealthtech.com/v1/perspective_schemas/2954937502943',
+              json=update_schema_mock_response)
+        client.update('tag_filter',
+                      schema=get_schema_mock_response['schema'],
+                      wait=False)
+        client.flush()
+        methods = [request.method for request in m.request_history]
+
+    assert methods.count('PUT') == 1
+
+
 def test_update_mismatch_name():
     client = PerspectiveClient('fake_api_key')
 
@@ -1,11 +1,13 @@
 import json
 import logging
 import os
+from unittest.mock import MagicMock
 
 import pytest
 import yaml
 from deepdiff import DeepDiff
 
+import chtools.perspective.data
 from chtools.perspective.data import Perspective
 
 logger = logging.getLogger('chtools.perspective')
@@ -84,6 +86,70 @@ def test_schema_to_spec(test_case):
     )
 
 
+@pytest.mark.parametrize(
+    'test_case', general_test_cases + schema_to_spec_test_cases
+
+)
+def test_spec_does_not_modify_schema(test_case):
+    perspective = Perspective(http_client=None)
+    schema_path = '{}/{}.json'.format(schemas_dir, test_case)
+    with open(schema_path) as schema_file:
+        schema = json.load(schema_file)
+    with open(schema_path) as schema_file:
+        expected_schema = json.load(schema_file)
+    perspective.schema = schema
+    perspective.spec
+    differences = DeepDiff(expected_schema, perspective.schema)
+    assert differences == {}, (
+        "DeepDiff reports the following differences between schema before "
+        "and after generating spec: {}".format(differences)
+    )
+
+
+def test_spec_cached_until_schema_changes():
+    perspective = Perspective(http_client=None)
+    schema_path = '{}/tag_filter.json'.format(schemas_dir)
+    with open(schema_path) as schema_file:
+        perspective.schema = json.load(schema_file)
+    spec = perspective.spec
+    assert perspective.spec is spec
+    perspective.name = 'tag_filter_renamed'
+    assert yaml.safe_load(perspective.spec)['name'] == 'tag_filter_renamed'
+
+
+def test_get_schema_ttl(monkeypatch):
+    monkeypatch.setattr(chtools.perspective.data, 'SCHEMA_TTL', 60)
+    monkeypatch.setattr(chtools.perspective.data, '_schema_cache', {})
+    schema_path = '{}/tag_filter.json'.format(schemas_dir)
+    http_client = MagicMock()
+    with open(schema_path) as schema_file:
+        http_client.get.return_value = {'schema': json.load(schema_file)}
+
+    perspective = Perspective(http_client, perspective_id='1234567890')
+    # Changes to one perspective aren't seen by others with the same id
+    perspective.name = 'tag_filter_renamed'
+    other_perspective = Perspective(http_client, perspective_id='1234567890')
+    assert other_perspective.name == 'tag_filter'
+    assert http_client.get.call_count == 1
+    # Updating CloudHealth means the schema needs to be retrieved again
+    perspective.update_cloudhealth()
+    assert http_client.get.call_count == 2
+
+
+def test_schema_ttl_from_env(monkeypatch):
+    monkeypatch.setenv('CH_SCHEMA_TTL', '30')
+    assert chtools.perspective.data._schema_ttl_from_env() == 30
+    monkeypatch.setenv('CH_SCHEMA_TTL', 'thirty')
+    assert chtools.perspective.data._schema_ttl_from_env() == 0
+
+
+def test_update_executor_created_once(monkeypatch):
+    monkeypatch.setattr(chtools.perspective.data, '_update_executor', None)
+    executor = chtools.perspective.data._get_update_executor()
+    assert executor is chtools.perspective.data._get_update_executor()
+    executor.shutdown()
+
+
 def test_update_filter_via_spec():
     perspective = Perspective(http_client=None)
     initial_schema_path = '{}/tag_filter.json'.format(schemas_dir)